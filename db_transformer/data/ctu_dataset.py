@@ -1,16 +1,27 @@
 from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import hashlib
+import itertools
 import json
 import os
+import re
 from pathlib import Path
 import shutil
 import warnings
 
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
+try:
+    import orjson
+except ImportError:  # optional - the standard json module is used instead
+    orjson = None
+
 from sqlalchemy.engine import Connection, create_engine
-from sqlalchemy.schema import MetaData, Table as SQLTable
+from sqlalchemy.schema import Table as SQLTable
 from sqlalchemy.sql import select, text
 
 from sklearn.preprocessing import MultiLabelBinarizer
@@ -19,7 +30,7 @@ import torch
 
 import torch_geometric.transforms as T
 from torch_geometric.data import HeteroData
-from torch_geometric.typing import NodeType
+from torch_geometric.typing import EdgeType, NodeType
 
 import torch_frame
 from torch_frame.config import TextEmbedderConfig
@@ -37,19 +48,255 @@ from db_transformer.data.dataset_defaults.ctu_repository_defauts import (
     CTU_REPOSITORY_DEFAULTS,
 )
 from db_transformer.data.dataset_defaults.utils import TaskType
+from db_transformer.helpers.database import get_reflected_metadata
 from db_transformer.helpers.objectpickle import serialize, deserialize
 
+# Torch CPU threads used for embedding and materialization. Override with the
+# DBT_NUM_THREADS environment variable.
+NUM_THREADS = int(os.environ.get("DBT_NUM_THREADS", os.cpu_count() or 1))
+
+
+def configure_torch_threads(num_threads: int = NUM_THREADS):
+    """
+    Set the torch intra-op and inter-op CPU thread counts used for materialization.
+
+    Called explicitly (by :py:meth:`CTUDataset.build_hetero_data`), never on import.
+    The inter-op pool can only be sized once per process, before any inter-op work.
+    If that is no longer possible, the current size is kept and a warning is issued.
+    """
+    torch.set_num_threads(num_threads)
+
+    num_interop_threads = max(1, num_threads // 4)
+    if torch.get_num_interop_threads() != num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            current = torch.get_num_interop_threads()
+            warnings.warn(f"Keeping {current} torch inter-op threads. Reason: {e}")
+
+
+# (ref_table, ref_columns) -> (deduplicated key index, row positions of the keys)
+RefIndexCache = Dict[Tuple[str, Tuple[str, ...]], Tuple[pd.Index, np.ndarray]]
+
 
 class GloveTextEmbedding:
-    def __init__(self):
-        from sentence_transformers import SentenceTransformer
+    MODEL_NAME = "sentence-transformers/average_word_embeddings_glove.6B.300d"
+    DIM = 300
 
-        self.model = SentenceTransformer(
-            "sentence-transformers/average_word_embeddings_glove.6B.300d"
+    def __init__(self, cache_dir: Optional[str] = None):
+        # the model is loaded lazily - only once there are sentences missing in the cache
+        self._model = None
+        self._word_embeddings: Optional[np.ndarray] = None
+
+        # on-disk cache of already embedded sentences, keyed by content hash
+        self.cache_path = (
+            _get_embed_cache_path(cache_dir) if cache_dir is not None else None
         )
+        self._cache = _load_embed_cache(self.cache_path) if self.cache_path else {}
+        self._new_keys: List[int] = []
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._load_model()
+        return self._model
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Pooling, WordEmbeddings
+
+        model = SentenceTransformer(self.MODEL_NAME)
+        if model.device.type == "cuda":
+            model = model.half()
+        self._model = model.eval()
+
+        # the GloVe model is just a word embedding lookup followed by mean pooling,
+        # which is much cheaper to evaluate directly in numpy than through torch
+        modules = list(self._model)
+        if (
+            len(modules) == 2
+            and isinstance(modules[0], WordEmbeddings)
+            and isinstance(modules[1], Pooling)
+            and modules[1].get_pooling_mode_str() == "mean"
+        ):
+            self._tokenizer = modules[0].tokenizer
+            self._word_embeddings = (
+                modules[0].emb_layer.weight.detach().float().cpu().numpy()
+            )
 
     def __call__(self, sentences: List[str]) -> torch.Tensor:
-        return torch.from_numpy(self.model.encode(sentences, show_progress_bar=False))
+        return torch.from_numpy(self._cached_encode(sentences))
+
+    def _cached_encode(self, sentences: List[str]) -> np.ndarray:
+        keys = np.fromiter(
+            (_sentence_hash(s) for s in sentences), dtype=np.uint64, count=len(sentences)
+        )
+
+        # embed every distinct sentence only once and scatter the result back
+        uniq_keys, first_idx, inverse = np.unique(
+            keys, return_index=True, return_inverse=True
+        )
+        uniq_keys = uniq_keys.tolist()
+
+        misses = [
+            (k, sentences[i]) for k, i in zip(uniq_keys, first_idx) if k not in self._cache
+        ]
+        if len(misses) > 0:
+            vectors = self._encode([s for _, s in misses])
+            # fp16 halves the size of the cache
+            self._cache.update(zip((k for k, _ in misses), vectors.astype(np.float16)))
+            self._new_keys.extend(k for k, _ in misses)
+
+        if len(uniq_keys) == 0:
+            return np.empty((0, self.DIM), dtype=np.float32)
+        return np.stack([self._cache[k] for k in uniq_keys]).astype(np.float32)[inverse]
+
+    def _encode(self, sentences: List[str]) -> np.ndarray:
+        model = self.model
+
+        if self._word_embeddings is not None:
+            return self._encode_mean_word_embeddings(sentences)
+
+        # sort by length so that each batch is padded only to its own maximum
+        order = np.argsort([len(s) for s in sentences], kind="stable")
+        with torch.inference_mode():
+            out = model.encode(
+                [sentences[i] for i in order],
+                show_progress_bar=False,
+                batch_size=1024,
+                convert_to_numpy=True,
+            )
+        return out[np.argsort(order)]
+
+    def _encode_mean_word_embeddings(self, sentences: List[str]) -> np.ndarray:
+        token_ids = [self._tokenizer.tokenize(s) for s in sentences]
+        lengths = np.fromiter(map(len, token_ids), dtype=np.int64, count=len(token_ids))
+
+        out = np.zeros((len(sentences), self._word_embeddings.shape[1]), dtype=np.float32)
+        nonempty = lengths > 0
+        if nonempty.any():
+            flat_ids = np.fromiter(itertools.chain.from_iterable(token_ids), dtype=np.int64)
+            starts = np.cumsum(lengths) - lengths
+            sums = np.add.reduceat(
+                self._word_embeddings[flat_ids], starts[nonempty], axis=0
+            )
+            out[nonempty] = sums / lengths[nonempty, None]
+        return out
+
+    def pop_new_entries(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the (keys, vectors) of the sentences embedded since the last call."""
+        keys, self._new_keys = self._new_keys, []
+        vectors = (
+            np.stack([self._cache[k] for k in keys])
+            if len(keys) > 0
+            else np.empty((0, self.DIM), dtype=np.float16)
+        )
+        return np.array(keys, dtype=np.uint64), vectors
+
+
+def _get_embed_cache_path(cache_dir: str) -> str:
+    return os.path.join(cache_dir, "glove.npz")
+
+
+def _load_embed_cache(path: str) -> Dict[int, np.ndarray]:
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as f:
+        return dict(zip(f["keys"].tolist(), f["vectors"]))
+
+
+def _save_embed_cache(path: str, entries: List[Tuple[np.ndarray, np.ndarray]]):
+    """
+    Merge newly embedded (keys, vectors) into the on-disk cache.
+
+    Only the parent process writes the cache - worker processes return their new entries
+    instead, otherwise the last worker to finish would overwrite those of the others.
+    """
+    entries = [(keys, vectors) for keys, vectors in entries if len(keys) > 0]
+    if len(entries) == 0:
+        return
+
+    # re-read the file, so that entries written since it was loaded are kept
+    cache = _load_embed_cache(path)
+    for keys, vectors in entries:
+        cache.update(zip(keys.tolist(), vectors))
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            keys=np.fromiter(cache.keys(), dtype=np.uint64, count=len(cache)),
+            vectors=np.stack(list(cache.values())),
+        )
+    os.replace(tmp_path, path)
+
+
+def _sentence_hash(sentence: str) -> int:
+    digest = hashlib.blake2b(str(sentence).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+@lru_cache(maxsize=None)
+def _get_text_embedder(cache_dir: str) -> GloveTextEmbedding:
+    # one instance per process, so that the model is loaded only once
+    return GloveTextEmbedding(cache_dir=cache_dir)
+
+
+def _materialize_table(
+    table_name: str,
+    df: pd.DataFrame,
+    col_to_stype: Dict[str, torch_frame.stype],
+    target_col: Optional[str],
+    materialized_dir: str,
+    embed_cache_dir: Optional[str],
+) -> Tuple[Dict[str, Dict[StatType, Any]], Optional[Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Materialize a single table and save its TensorFrame to `<materialized_dir>/<table_name>.pt`.
+
+    Defined at module level so that it can be run in a worker process.
+    Returns the column stats and the newly embedded sentences (if any) to be cached.
+    """
+    text_embedder = None
+    text_embedder_cfg = None
+    if embed_cache_dir is not None and torch_frame.stype.text_embedded in set(
+        col_to_stype.values()
+    ):
+        text_embedder = _get_text_embedder(embed_cache_dir)
+        text_embedder_cfg = TextEmbedderConfig(text_embedder=text_embedder, batch_size=256)
+
+    def __build_frame_dataset(table, col_to_stype):
+        return Dataset(
+            df=table,
+            col_to_stype=col_to_stype,
+            col_to_text_embedder_cfg=text_embedder_cfg,
+            target_col=target_col,
+        ).materialize(path=os.path.join(materialized_dir, table_name))
+
+    try:
+        dataset = __build_frame_dataset(df, col_to_stype)
+
+    except pd.errors.OutOfBoundsDatetime as e:
+        for col, _stype in col_to_stype.items():
+            if _stype != torch_frame.stype.timestamp:
+                continue
+            df[col].loc[MAX_TIMESTAMP.date() < df[col]] = MAX_TIMESTAMP.date()
+            df[col].loc[MIN_TIMESTAMP.date() > df[col]] = MIN_TIMESTAMP.date()
+
+        dataset = __build_frame_dataset(df, col_to_stype)
+
+    stype_to_col_str = "\n".join(
+        [f"\t{k}: {v}" for k, v in dataset.tensor_frame.col_names_dict.items()]
+    )
+    print(f"Table {table_name} has stypes:\n{stype_to_col_str}")
+
+    tf_path = os.path.join(materialized_dir, f"{table_name}.pt")
+    if not os.path.exists(tf_path):
+        torch.save(dataset.tensor_frame, tf_path)
+
+    new_embeddings = text_embedder.pop_new_entries() if text_embedder is not None else None
+
+    return dataset.col_stats, new_embeddings
 
 
 class CTUDataset:
@@ -103,7 +350,10 @@ class CTUDataset:
         device: str = None,
         force_rematerilize: bool = False,
         no_text_emebedding: bool = False,
+        num_workers: int = 1,
     ) -> Tuple[HeteroData, Dict[NodeType, Dict[str, Dict[StatType, Any]]]]:
+        configure_torch_threads()
+
         data = HeteroData()
         col_stats_dict = {}
 
@@ -117,13 +367,20 @@ class CTUDataset:
             shutil.rmtree(materialized_dir)
         Path(materialized_dir).mkdir(parents=True, exist_ok=True)
 
-        if no_text_emebedding:
-            text_embedder_cfg = None
-        else:
-            text_embedder_cfg = TextEmbedderConfig(text_embedder=GloveTextEmbedding())
+        embed_cache_dir = (
+            None if no_text_emebedding else os.path.join(self.root_dir, "embed_cache")
+        )
+
+        # hashed referenced keys, shared by all foreign keys pointing to the same columns
+        ref_index_cache: RefIndexCache = {}
+
+        # (df, col_to_stype, target_col) to materialize for each table
+        jobs: Dict[
+            NodeType, Tuple[pd.DataFrame, Dict[str, torch_frame.stype], Optional[str]]
+        ] = {}
 
         for table_name, table_schema in wrap_progress(
-            self.schema.items(), verbose=True, desc="Building data"
+            self.schema.items(), verbose=True, desc="Preparing data"
         ):
             df = table_dfs[table_name]
 
@@ -131,13 +388,10 @@ class CTUDataset:
                 continue
 
             # convert all foreign keys
-            for fk_def in table_schema.foreign_keys:
-                ref_df = table_dfs[fk_def.ref_table]
-                id = (table_name, "fk-" + "-".join(fk_def.columns), fk_def.ref_table)
-                try:
-                    data[id].edge_index = self._fk_to_index(fk_def, df, ref_df, device)
-                except Exception as e:
-                    warnings.warn(f"Failed to join on foreign key {id}. Reason: {e}")
+            for id, edge_index in self._all_fks_to_indices(
+                table_name, table_schema, df, table_dfs, ref_index_cache, device
+            ).items():
+                data[id].edge_index = edge_index
 
             col_to_stype = self._schema_to_stype_dict(self.schema[table_name])
 
@@ -147,13 +401,13 @@ class CTUDataset:
                 else None
             )
 
-            for col in df.columns:
-                if col not in col_to_stype:
-                    continue
-                if df[col].dtype.__str__().startswith("timedelta"):
+            # only schema-covered columns need any dtype fixing
+            for col in [c for c in df.columns if c in col_to_stype]:
+                dtype_str = str(df[col].dtype)
+                if dtype_str.startswith("timedelta"):
                     df[col] = df[col].dt.nanoseconds
                 if (
-                    df[col].dtype.__str__().startswith("object")
+                    dtype_str.startswith("object")
                     and col_to_stype[col] == torch_frame.stype.categorical
                 ):
                     mlb = MultiLabelBinarizer()
@@ -192,39 +446,67 @@ class CTUDataset:
             ):
                 df[target_col] = pd.factorize(df[target_col])[0]
 
-            def __build_frame_dataset(table, col_to_stype):
-                return Dataset(
-                    df=table,
-                    col_to_stype=col_to_stype,
-                    col_to_text_embedder_cfg=text_embedder_cfg,
-                    target_col=target_col,
-                ).materialize(device, path=os.path.join(materialized_dir, table_name))
-
-            try:
-                dataset = __build_frame_dataset(df, col_to_stype)
-
-            except pd.errors.OutOfBoundsDatetime as e:
-                for col, _stype in col_to_stype.items():
-                    if _stype != torch_frame.stype.timestamp:
-                        continue
-                    df[col].loc[MAX_TIMESTAMP.date() < df[col]] = MAX_TIMESTAMP.date()
-                    df[col].loc[MIN_TIMESTAMP.date() > df[col]] = MIN_TIMESTAMP.date()
-
-                dataset = __build_frame_dataset(df, col_to_stype)
+            jobs[table_name] = (df, col_to_stype, target_col)
+
+        # featurization is CPU-bound and independent across tables, so it can be run
+        # in `num_workers` processes. Under the "spawn" and "forkserver" start methods
+        # the workers re-import the calling script, which then needs a __main__ guard.
+        if num_workers > 1:
+            # split the torch threads among the workers instead of oversubscribing
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                initializer=torch.set_num_threads,
+                initargs=(max(1, NUM_THREADS // num_workers),),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _materialize_table,
+                        table_name,
+                        *job,
+                        materialized_dir,
+                        embed_cache_dir,
+                    ): table_name
+                    for table_name, job in jobs.items()
+                }
+                results = {
+                    futures[future]: future.result()
+                    for future in wrap_progress(
+                        as_completed(futures),
+                        verbose=True,
+                        desc="Building data",
+                        total=len(futures),
+                    )
+                }
+        else:
+            results = {
+                table_name: _materialize_table(
+                    table_name, *job, materialized_dir, embed_cache_dir
+                )
+                for table_name, job in wrap_progress(
+                    jobs.items(), verbose=True, desc="Building data"
+                )
+            }
 
-            stype_to_col_str = "\n".join(
-                [f"\t{k}: {v}" for k, v in dataset.tensor_frame.col_names_dict.items()]
+        if embed_cache_dir is not None:
+            _save_embed_cache(
+                _get_embed_cache_path(embed_cache_dir),
+                [new for _, new in results.values() if new is not None],
             )
-            print(f"Table {table_name} has stypes:\n{stype_to_col_str}")
 
-            data[table_name].tf = dataset.tensor_frame.to(device)
-            col_stats_dict[table_name] = dataset.col_stats
+        for table_name in jobs:
+            # memory-map the materialized features instead of keeping them in RAM
+            tf_path = os.path.join(materialized_dir, f"{table_name}.pt")
+            tf: torch_frame.TensorFrame = torch.load(tf_path, mmap=True, weights_only=False)
+            if device is not None:
+                tf = tf.to(device)
+
+            data[table_name].tf = tf
+            col_stats_dict[table_name] = results[table_name][0]
             if table_name == self.defaults.target_table:
-                data[table_name].y = dataset.tensor_frame.y.to(device)
-                if self.defaults.task == TaskType.CLASSIFICATION:
-                    data[table_name].y = data[table_name].y
-                if self.defaults.task == TaskType.REGRESSION:
-                    data[table_name].y = data[table_name].y.float()
+                # tf is already on the device - reuse its targets instead of another copy
+                data[table_name].y = (
+                    tf.y.float() if self.defaults.task == TaskType.REGRESSION else tf.y
+                )
 
         # add reverse edges
         data: HeteroData = T.ToUndirected()(data)
@@ -247,7 +529,9 @@ class CTUDataset:
         return Connection(create_engine(cls.get_url(dataset)))
 
     @classmethod
-    def make_db(cls, dataset: CTUDatasetName) -> Tuple[Database, Schema]:
+    def make_db(
+        cls, dataset: CTUDatasetName, max_workers: int = 8
+    ) -> Tuple[Database, Schema]:
         remote_conn = cls.create_remote_connection(dataset)
 
         inspector = DBInspector(remote_conn)
@@ -261,14 +545,13 @@ class CTUDataset:
         )
         schema = analyzer.guess_schema()
 
-        remote_md = MetaData()
-        remote_md.reflect(bind=inspector.engine)
+        table_names = inspector.get_tables()
+        remote_md = get_reflected_metadata(inspector.engine, only=table_names)
 
-        tables = {}
+        # one pooled engine shared by all download workers
+        download_engine = create_engine(cls.get_url(dataset), pool_size=max_workers)
 
-        for table_name in wrap_progress(
-            inspector.get_tables(), verbose=True, desc="Downloading tables"
-        ):
+        def _download_table(table_name: str) -> Tuple[str, Table]:
             pk = inspector.get_primary_key(table_name)
             pkey_col = list(pk)[0] if len(pk) == 1 else None
 
@@ -282,55 +565,186 @@ class CTUDataset:
             dtypes: Dict[str, str] = {}
 
             for c in src_table.columns:
-                str_type = c.type.__str__().split("(")[0]
-                dtype = MARIADB_TO_PANDAS.get(str_type, None)
+                dtype = _mariadb_to_pandas_dtype(str(c.type))
                 if dtype is not None:
                     dtypes[c.name] = dtype
                 else:
                     warnings.warn(f"Unknown data type {c.type}")
 
             statement = select(src_table.columns)
-            query = statement.compile(remote_conn.engine)
-            df = pd.read_sql_query(sql=text(query.string), con=remote_conn, dtype=dtypes)
-            tables[table_name] = Table(
+            query = statement.compile(download_engine)
+            with download_engine.connect() as conn:
+                df = pd.read_sql_query(sql=text(query.string), con=conn)
+            df = df.astype({k: v for k, v in dtypes.items() if k in df.columns})
+            return table_name, Table(
                 df=df, fkey_col_to_pkey_table=fk_dict, pkey_col=pkey_col
             )
 
+        tables = {}
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(_download_table, table_name)
+                    for table_name in table_names
+                ]
+                for future in wrap_progress(
+                    as_completed(futures),
+                    verbose=True,
+                    desc="Downloading tables",
+                    total=len(futures),
+                ):
+                    table_name, table = future.result()
+                    tables[table_name] = table
+        finally:
+            download_engine.dispose()
+
         return Database(tables), schema
 
+    def _all_fks_to_indices(
+        self,
+        table_name: str,
+        table_schema: TableSchema,
+        table: pd.DataFrame,
+        table_dfs: Dict[str, pd.DataFrame],
+        ref_index_cache: Optional[RefIndexCache] = None,
+        device=None,
+    ) -> Dict[EdgeType, torch.Tensor]:
+        if ref_index_cache is None:
+            ref_index_cache = {}
+
+        out: Dict[EdgeType, torch.Tensor] = {}
+        for fk_def in table_schema.foreign_keys:
+            id = (table_name, "fk-" + "-".join(fk_def.columns), fk_def.ref_table)
+            try:
+                out[id] = self._fk_to_index(
+                    fk_def, table, table_dfs[fk_def.ref_table], device, ref_index_cache
+                )
+            except Exception as e:
+                warnings.warn(f"Failed to join on foreign key {id}. Reason: {e}")
+        return out
+
     def _fk_to_index(
         self,
         fk_def: ForeignKeyDef,
         table: pd.DataFrame,
         ref_table: pd.DataFrame,
         device=None,
+        ref_index_cache: Optional[RefIndexCache] = None,
     ) -> torch.Tensor:
         assert isinstance(table.index, pd.RangeIndex)
         assert isinstance(ref_table.index, pd.RangeIndex)
 
-        # keep just the index columns
-        table = table[fk_def.columns].copy()
-        ref_table = ref_table[fk_def.ref_columns].copy()
-
-        table.index.name = "__pandas_index"
-        ref_table.index.name = "__pandas_index"
-        table.reset_index(inplace=True)
-        ref_table.reset_index(inplace=True)
-
-        out = pd.merge(
-            left=table,
-            right=ref_table,
-            how="inner",
-            left_on=fk_def.columns,
-            right_on=fk_def.ref_columns,
-        )
+        # the hash join would silently find no matches instead
+        for col, ref_col in zip(fk_def.columns, fk_def.ref_columns):
+            kind, ref_kind = _join_key_kind(table[col]), _join_key_kind(ref_table[ref_col])
+            if kind != ref_kind:
+                raise ValueError(
+                    f"Cannot join {kind} column '{col}' ({table[col].dtype}) "
+                    f"on {ref_kind} column '{ref_col}' ({ref_table[ref_col].dtype})."
+                )
 
-        return (
-            torch.from_numpy(out[["__pandas_index_x", "__pandas_index_y"]].to_numpy())
-            .t()
-            .contiguous()
-            .to(device)
-        )
+        edge_index = None
+        if len(table) >= POLARS_JOIN_MIN_ROWS:
+            edge_index = self._fk_to_index_polars(fk_def, table, ref_table)
+
+        if edge_index is None:
+            edge_index = self._fk_to_index_pandas(fk_def, table, ref_table, ref_index_cache)
+
+        return torch.from_numpy(edge_index).to(device)
+
+    def _fk_to_index_pandas(
+        self,
+        fk_def: ForeignKeyDef,
+        table: pd.DataFrame,
+        ref_table: pd.DataFrame,
+        ref_index_cache: Optional[RefIndexCache] = None,
+    ) -> np.ndarray:
+        # build the key indices straight from the column arrays, without copying frames
+        def _key_index(df: pd.DataFrame, cols: List[str]) -> pd.Index:
+            if len(cols) == 1:
+                return pd.Index(df[cols[0]].array, copy=False)
+            return pd.MultiIndex.from_arrays([df[c].array for c in cols])
+
+        # hash the referenced keys once and probe them with the child keys
+        cache_key = (fk_def.ref_table, tuple(fk_def.ref_columns))
+        if ref_index_cache is not None and cache_key in ref_index_cache:
+            ref_keys, ref_positions = ref_index_cache[cache_key]
+        else:
+            ref_keys = _key_index(ref_table, fk_def.ref_columns)
+            is_first = ~ref_keys.duplicated()
+            ref_keys, ref_positions = ref_keys[is_first], np.flatnonzero(is_first)
+            if ref_index_cache is not None:
+                ref_index_cache[cache_key] = (ref_keys, ref_positions)
+
+        parent_idx = ref_keys.get_indexer(_key_index(table, fk_def.columns))
+
+        # null keys reference nothing (as in SQL and in the Polars join)
+        parent_idx[
+            np.logical_or.reduce([table[c].isna().to_numpy() for c in fk_def.columns])
+        ] = -1
+
+        # drop child rows without a match (-1)
+        child_idx = np.flatnonzero(parent_idx >= 0)
+        parent_idx = ref_positions[parent_idx[child_idx]]
+
+        return np.stack([child_idx, parent_idx])
+
+    def _fk_to_index_polars(
+        self, fk_def: ForeignKeyDef, table: pd.DataFrame, ref_table: pd.DataFrame
+    ) -> Optional[np.ndarray]:
+        """Multi-threaded join for large tables. Returns None if Polars can't be used."""
+        try:
+            import polars as pl
+        except ImportError:
+            return None
+
+        keys = [f"__key_{i}" for i in range(len(fk_def.columns))]
+
+        # convert column by column - selecting and renaming a sub-frame would copy it
+        def _key_frame(df: pd.DataFrame, cols: List[str]) -> "pl.DataFrame":
+            return pl.DataFrame(
+                [pl.from_pandas(df[c]).alias(k) for c, k in zip(cols, keys)]
+            )
+
+        # keys that Polars/Arrow can't convert or cast (e.g. mixed-type object columns
+        # or UInt64 values above the Int64 range) are left to the pandas hash join
+        try:
+            child = _key_frame(table, fk_def.columns)
+
+            # cast both sides to a common type, matching what the pandas hash join would
+            key_dtypes = []
+            for col, ref_col, k in zip(fk_def.columns, fk_def.ref_columns, keys):
+                kind = _join_key_kind(table[col])
+                if kind == "numeric":
+                    dtypes = (table[col].dtype, ref_table[ref_col].dtype)
+                    is_float = any(pd.api.types.is_float_dtype(d) for d in dtypes)
+                    key_dtypes.append(pl.Float64 if is_float else pl.Int64)
+                elif kind == "string":
+                    key_dtypes.append(pl.String)
+                else:
+                    key_dtypes.append(child.schema[k])
+            casts = [pl.col(k).cast(dtype) for k, dtype in zip(keys, key_dtypes)]
+
+            # null keys never match in the (inner) join
+            child = child.with_columns(casts).with_row_index("__child_index")
+
+            parent = _key_frame(ref_table, fk_def.ref_columns)
+            parent = (
+                parent.with_columns(casts)
+                .with_row_index("__parent_index")
+                .unique(subset=keys, keep="first", maintain_order=True)
+            )
+
+            out = (
+                child.join(parent, on=keys, how="inner")
+                .select(["__child_index", "__parent_index"])
+                .sort("__child_index")
+                .cast(pl.Int64)
+            )
+            return np.ascontiguousarray(out.to_numpy().T)
+        except (pl.exceptions.PolarsError, ValueError, TypeError, OverflowError):
+            return None
 
     def _schema_to_stype_dict(
         self, table_schema: TableSchema
@@ -343,14 +757,31 @@ class CTUDataset:
         return merged
 
     def _save_schema(self):
-        with open(self.schema_path, "w+") as f:
-            json.dump(serialize(self.schema), f, indent=4)
+        if orjson is None:
+            with open(self.schema_path, "w") as f:
+                json.dump(serialize(self.schema), f, indent=4)
+            return
+
+        Path(self.schema_path).write_bytes(
+            orjson.dumps(
+                serialize(self.schema),
+                option=orjson.OPT_INDENT_2
+                | orjson.OPT_NON_STR_KEYS
+                | orjson.OPT_SERIALIZE_NUMPY,
+            )
+        )
 
     def _load_schema(self) -> Schema:
-        with open(self.schema_path, "r") as f:
-            return deserialize(json.load(f))
+        if orjson is None:
+            with open(self.schema_path, "r") as f:
+                return deserialize(json.load(f))
+
+        return deserialize(orjson.loads(Path(self.schema_path).read_bytes()))
 
 
+# child tables at least this long are joined with Polars (if installed)
+POLARS_JOIN_MIN_ROWS = 1_000_000
+
 MAX_TIMESTAMP = pd.Timestamp("2262-04-10")
 MIN_TIMESTAMP = pd.Timestamp("1677-09-23")
 
@@ -399,3 +830,28 @@ MARIADB_TO_PANDAS = {
     "MEDIUMBLOB": "object",
     "LONGBLOB": "object",
 }
+
+_MARIADB_LUT = {k.upper(): v for k, v in MARIADB_TO_PANDAS.items()}
+_TYPE_RE = re.compile(r"^([A-Z ]+)")
+
+
+def _join_key_kind(series: pd.Series) -> str:
+    """Coarse kind of a key column - keys of different kinds never match in a join."""
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if pd.api.types.is_timedelta64_dtype(dtype):
+        return "timedelta"
+    if isinstance(dtype, pd.CategoricalDtype):
+        return _join_key_kind(pd.Series(dtype.categories))
+    return "string"
+
+
+@lru_cache(maxsize=None)
+def _mariadb_to_pandas_dtype(type_str: str) -> Optional[Any]:
+    m = _TYPE_RE.match(type_str.upper())
+    return _MARIADB_LUT.get(m.group(1).strip()) if m else None
@@ -1,24 +1,25 @@
-from typing import Iterable, List, TypeVar
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple, TypeVar
 import sqlalchemy
 
-from sqlalchemy.engine import Connection
+from sqlalchemy.engine import Connection, CursorResult, Engine, Row
 from sqlalchemy.schema import Column, ForeignKeyConstraint, MetaData, Table
-from sqlalchemy.sql import func, select, table
+from sqlalchemy.sql import func, select, table, text
 
 from db_transformer.db.db_inspector import DBInspector
 from db_transformer.helpers.progress import wrap_progress
 
 
-def copy_database(src_inspector: DBInspector, dst: Connection, verbose=False):
+def copy_database(
+    src_inspector: DBInspector, dst: Connection, verbose=False, batch_size: int = 10_000
+):
     with dst.begin():  # transaction ends at the end of the `with` block
         dst_metadata = MetaData()
         dst_metadata.reflect(bind=dst.engine)
 
-        src_metadata = MetaData()
-        src_metadata.reflect(bind=src_inspector.engine)
-
         tables = src_inspector.get_tables()
 
+        src_metadata = get_reflected_metadata(src_inspector.engine, only=tables)
+
         create_tables: List[Table] = []
         for table_name in tables:
             pk = src_inspector.get_primary_key(table_name)
@@ -42,20 +43,98 @@ def copy_database(src_inspector: DBInspector, dst: Connection, verbose=False):
 
         dst_metadata.create_all(dst.engine, tables=create_tables)
 
+        # approximate row counts are enough for the progress bars
+        table_lens = get_all_table_lens(src_inspector.connection) if verbose else {}
+
         for table_name, dst_table in wrap_progress(
             zip(tables, create_tables), verbose=verbose, desc="Tables", total=len(tables)
         ):
-            # TODO: Insert/Select in batch
             select_query = select(dst_table.columns)
-            for res in wrap_progress(
-                src_inspector.connection.execute(select_query).all(),
+            # per-statement option, so that the caller's connection is left untouched;
+            # only streams with drivers that support server-side cursors
+            result = src_inspector.connection.execute(
+                select_query, execution_options={"stream_results": True}
+            )
+
+            for rows in wrap_progress(
+                _fetch_batches(result, batch_size),
                 verbose=verbose,
-                desc="Rows",
+                desc="Row batches",
+                total=(
+                    -(-table_lens[table_name] // batch_size)
+                    if table_name in table_lens
+                    else None
+                ),
             ):
-                dst.execute(dst_table.insert().values(res))
+                # executemany - a single multi-row insert per batch
+                dst.execute(dst_table.insert(), [dict(r._mapping) for r in rows])
+
+
+def _fetch_batches(result: CursorResult, batch_size: int) -> Iterable[List[Row]]:
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+_reflected_metadata: Dict[Tuple[str, Optional[FrozenSet[str]]], MetaData] = {}
+
 
+def get_reflected_metadata(
+    engine: Engine, only: Optional[Iterable[str]] = None
+) -> MetaData:
+    """
+    Reflect the database behind `engine` (limited to the `only` tables if given).
 
-def get_table_len(table_name: str, connection: Connection) -> int:
-    query = table(table_name).select().column(func.count(None))
+    Reflection takes many round-trips, so the result is reused for any later call with
+    the same database URL and tables. In-memory databases are always reflected anew.
+    The returned `MetaData` is shared - don't add tables to it.
+    """
+    only = frozenset(only) if only is not None else None
+
+    if engine.url.database in (None, "", ":memory:"):
+        key = None
+    else:
+        key = (engine.url.render_as_string(hide_password=False), only)
+
+    if key is None or key not in _reflected_metadata:
+        metadata = MetaData()
+        metadata.reflect(bind=engine, only=sorted(only) if only is not None else None)
+        if key is None:
+            return metadata
+        _reflected_metadata[key] = metadata
+
+    return _reflected_metadata[key]
+
+
+def get_table_len(
+    table_name: str, connection: Connection, schema_name: Optional[str] = None
+) -> int:
+    query = table(table_name, schema=schema_name).select().column(func.count(None))
     out = connection.execute(query).scalar()
     return int(out)
+
+
+def get_all_table_lens(
+    connection: Connection, schema_name: Optional[str] = None, exact: bool = False
+) -> Dict[str, int]:
+    """
+    Get the row counts of all tables in a single round-trip to `information_schema`.
+
+    For InnoDB the counts in `information_schema` are only estimates. Pass `exact=True`
+    (or use a dialect other than MySQL/MariaDB) to run a `COUNT(*)` per table instead.
+    """
+    if exact or connection.dialect.name not in ("mysql", "mariadb"):
+        table_names = sqlalchemy.inspect(connection).get_table_names(schema=schema_name)
+        return {t: get_table_len(t, connection, schema_name) for t in table_names}
+
+    query = text(
+        "SELECT table_name, table_rows FROM information_schema.tables "
+        "WHERE table_schema = " + ("DATABASE()" if schema_name is None else ":schema_name")
+    )
+    params = {} if schema_name is None else {"schema_name": schema_name}
+    return {
+        name: int(rows) if rows is not None else 0
+        for name, rows in connection.execute(query, params).all()
+    }
@@ -1,4 +1,3 @@
-from collections import defaultdict
 from typing import Any, Callable, Dict, List, Optional, Union
 
 import torch
@@ -27,22 +26,15 @@ class NodeApplied(torch.nn.Module):
             self.node_layer_dict = torch.nn.ModuleDict(self.node_layer_dict)
 
     def forward(self, x_dict: Dict[NodeType, Any], *argv) -> Dict[NodeType, Any]:
-        out_dict: Dict[NodeType, Any] = {}
-
-        if self.dynamic_args:
-            input_dict = defaultdict(list)
-            for k in x_dict:
-                input_dict[k].append(x_dict[k])
-                for arg in argv:
-                    if not isinstance(arg, dict):
-                        input_dict[k].append(arg)
-                    else:
-                        input_dict[k].append(arg[k])
-
-            for k, xs in input_dict.items():
-                out_dict[k] = self.node_layer_dict[k](*xs)
-        else:
-            for k, x in x_dict.items():
-                out_dict[k] = self.node_layer_dict[k](x)
-
-        return out_dict
+        if not self.dynamic_args:
+            return {k: self.node_layer_dict[k](x) for k, x in x_dict.items()}
+
+        # decide once per call which args are per-node dicts and which are broadcast
+        arg_is_dict = [isinstance(arg, dict) for arg in argv]
+
+        return {
+            k: self.node_layer_dict[k](
+                x, *(arg[k] if is_dict else arg for arg, is_dict in zip(argv, arg_is_dict))
+            )
+            for k, x in x_dict.items()
+        }
@@ -36,6 +36,7 @@ def create_tabtransformer_model(
     num_layers = config.get("num_layers", 1)
     batch_norm = config.get("batch_norm", False)
     dropout = config.get("dropout", 0)
+    compile_modules = config.get("compile", False)
 
     is_classification = defaults.task == TaskType.CLASSIFICATION
 
@@ -72,16 +73,8 @@ def create_tabtransformer_model(
             )
         return layers
 
-    return BlueprintModel(
-        target=target,
-        embed_dim=embed_dim,
-        col_stats_per_table=col_stats_dict,
-        col_names_dict_per_table=col_names_dict,
-        edge_types=edge_types,
-        stype_encoder_dict=get_encoder("tabtransformer"),
-        positional_encoding=False,
-        num_gnn_layers=gnn_layers,
-        pre_combination=lambda i, node, cols: Sequential(
+    def get_pre_combination(node):
+        module = Sequential(
             "x_in_raw",
             [
                 (get_cat_num_split(node), "x_in_raw -> x_num, x_in"),
@@ -91,7 +84,22 @@ def create_tabtransformer_model(
                     "x_num, x_out -> x_out",
                 ),
             ],
-        ),
+        )
+        if compile_modules:
+            # each node type gets its own compiled graph specialized on its column count
+            module = torch.compile(module, mode="reduce-overhead", fullgraph=False)
+        return module
+
+    return BlueprintModel(
+        target=target,
+        embed_dim=embed_dim,
+        col_stats_per_table=col_stats_dict,
+        col_names_dict_per_table=col_names_dict,
+        edge_types=edge_types,
+        stype_encoder_dict=get_encoder("tabtransformer"),
+        positional_encoding=False,
+        num_gnn_layers=gnn_layers,
+        pre_combination=lambda i, node, cols: get_pre_combination(node),
         table_combination=lambda i, edge, cols: MeanAddConv(),
         decoder_aggregation=lambda x: x.view(*x.shape[:-2], -1),
         decoder=lambda cols: get_decoder(
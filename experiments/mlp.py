@@ -1,7 +1,9 @@
 import argparse
+import operator
 import os
 import random
 import uuid
+import warnings
 from dataclasses import asdict, dataclass, field
 from typing import Callable, Dict, List, Literal, Optional, Tuple, TypeVar, Union
 from typing import get_args as t_get_args
@@ -12,14 +14,13 @@ import lovely_tensors as lt
 import mlflow
 import numpy as np
 import torch
-import torch_geometric.transforms as T
+from torch.nn import functional as F
 from db_transformer.data.dataset_defaults.fit_dataset_defaults import (
     FITDatasetName,
     FIT_DATASET_DEFAULTS,
     FITDatasetDefaults,
     TaskType,
 )
-from db_transformer.nn.embedder import SingleTableEmbedder, CatEmbedder, NumEmbedder
 from db_transformer.data.fit_dataset import FITRelationalDataset
 from db_transformer.data.utils import HeteroDataBuilder
 from db_transformer.helpers.timer import Timer
@@ -29,7 +30,6 @@ from simple_parsing import ArgumentParser, DashVariant
 from sqlalchemy.engine import Connection
 from torch.utils.data import Dataset
 from torch_geometric.data import HeteroData
-from torch_geometric.loader import DataLoader
 
 lt.monkey_patch()
 
@@ -37,6 +37,9 @@ random.seed(0)
 np.random.seed(0)
 torch.manual_seed(0)
 
+# allow TF32 tensor cores for any remaining float32 matmuls
+torch.set_float32_matmul_precision("high")
+
 
 @dataclass
 class DataConfig:
@@ -58,21 +61,98 @@ class ModelConfig:
 
 
 class LinearBlock(torch.nn.Module):
+    # a constant, so that TorchScript only compiles the branch that is actually taken
+    _fast: torch.jit.Final[bool]
+
     def __init__(self, in_dim: int, out_dim: int, config: ModelConfig) -> None:
         super().__init__()
 
-        self.block = torch.nn.ModuleList()
-        self.block.append(torch.nn.Linear(in_dim, out_dim, bias=not config.batch_norm))
-        if config.batch_norm:
-            self.block.append(torch.nn.BatchNorm1d(out_dim))
-        self.block.append(torch.nn.ReLU())
-        if config.dropout > 0.0:
-            self.block.append(torch.nn.Dropout1d(p=config.dropout))
+        # without batch norm and dropout, the block is just a linear layer + ReLU
+        self._fast = not config.batch_norm and config.dropout == 0.0
+
+        if self._fast:
+            linear = torch.nn.Linear(in_dim, out_dim)
+            self.weight = linear.weight
+            self.bias = linear.bias
+        else:
+            layers: List[torch.nn.Module] = [
+                torch.nn.Linear(in_dim, out_dim, bias=not config.batch_norm)
+            ]
+            if config.batch_norm:
+                layers.append(torch.nn.BatchNorm1d(out_dim))
+            layers.append(torch.nn.ReLU())
+            if config.dropout > 0.0:
+                layers.append(torch.nn.Dropout1d(p=config.dropout))
+
+            self.block = torch.nn.Sequential(*layers)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self._fast:
+            # in-place ReLU reuses the output of the matmul
+            return F.relu_(F.linear(x, self.weight, self.bias))
+        return self.block(x)
+
+
+class GroupedTableEmbedder(torch.nn.Module):
+    """Embeds all categorical and all numerical columns of a table, with one op per group.
+
+    Input tensor: [..., n_columns] -> output: [..., n_columns, dim], where the categorical
+    columns come first, followed by the numerical ones.
+    """
+
+    def __init__(self, dim: int, column_defs: List[ColumnDef]) -> None:
+        super().__init__()
+
+        cat_idx = [
+            i for i, c in enumerate(column_defs) if isinstance(c, CategoricalColumnDef)
+        ]
+        num_idx = [i for i, c in enumerate(column_defs) if isinstance(c, NumericColumnDef)]
+
+        if len(cat_idx) + len(num_idx) != len(column_defs):
+            raise ValueError("Only categorical and numeric columns can be embedded.")
+
+        self.register_buffer("cat_idx", torch.tensor(cat_idx, dtype=torch.long))
+        self.register_buffer("num_idx", torch.tensor(num_idx, dtype=torch.long))
+
+        # all categorical columns share one embedding table, each with its own offset
+        cards = torch.tensor([column_defs[i].card for i in cat_idx], dtype=torch.long)
+        self.register_buffer("cat_offsets", cards.cumsum(0) - cards)
+        self.cat_embedding = torch.nn.Embedding(max(1, int(cards.sum())), dim)
+
+        # equivalent to a separate torch.nn.Linear(1, dim) for each numerical column
+        self.num_weight = torch.nn.Parameter(torch.empty(len(num_idx), dim).uniform_(-1, 1))
+        self.num_bias = torch.nn.Parameter(torch.empty(len(num_idx), dim).uniform_(-1, 1))
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        for layer in self.block:
-            x = layer(x)
-        return x
+        cat_emb = self.cat_embedding(
+            x.index_select(-1, self.cat_idx).long() + self.cat_offsets
+        )
+        num_emb = (
+            x.index_select(-1, self.num_idx).unsqueeze(-1) * self.num_weight + self.num_bias
+        )
+        return torch.cat([cat_emb, num_emb], dim=-2)
+
+
+def check_categorical_codes(
+    x: torch.Tensor, column_defs: List[ColumnDef], column_names: List[str]
+) -> None:
+    """Raise if any categorical code is out of range.
+
+    :py:class:`GroupedTableEmbedder` shares a single embedding table among all categorical
+    columns, so such a code would silently read a row of a neighbouring column instead.
+    """
+    cat_idx = [i for i, c in enumerate(column_defs) if isinstance(c, CategoricalColumnDef)]
+    if len(cat_idx) == 0 or x.shape[0] == 0:
+        return
+
+    # a single device -> host transfer for all the columns
+    lo, hi = x[:, cat_idx].long().aminmax(dim=0)
+    for i, col_lo, col_hi in zip(cat_idx, lo.tolist(), hi.tolist()):
+        if col_lo < 0 or col_hi >= column_defs[i].card:
+            raise IndexError(
+                f"Categorical feature '{column_names[i]}' at index {i} has codes in "
+                f"[{col_lo}, {col_hi}], out of range for cardinality {column_defs[i].card}"
+            )
 
 
 class Model(torch.nn.Module):
@@ -83,17 +163,10 @@ class Model(torch.nn.Module):
         n_features: int,
         defaults: FITDatasetDefaults,
         column_defs: List[ColumnDef],
-        column_names: List[str],
     ):
         super().__init__()
 
-        self.embedder = SingleTableEmbedder(
-            (CategoricalColumnDef, lambda: CatEmbedder(dim=config.dim)),
-            (NumericColumnDef, lambda: NumEmbedder(dim=config.dim)),
-            dim=config.dim,
-            column_defs=column_defs,
-            column_names=column_names,
-        )
+        self.embedder = GroupedTableEmbedder(dim=config.dim, column_defs=column_defs)
 
         assert defaults.task == TaskType.CLASSIFICATION
 
@@ -108,67 +181,92 @@ class Model(torch.nn.Module):
         dims = [in_dim, *config.layers, out_dim]
         dims, (last_a, last_b) = dims[:-1], tuple(dims[-2:])
 
-        self.layers = torch.nn.ModuleList(
-            [LinearBlock(a, b, config) for a, b in zip(dims[:-1], dims[1:])]
-        )
+        layers: List[torch.nn.Module] = [
+            LinearBlock(a, b, config) for a, b in zip(dims[:-1], dims[1:])
+        ]
+        layers.append(torch.nn.Linear(last_a, last_b))
 
-        self.layers.append(torch.nn.Linear(last_a, last_b))
+        self.layers = torch.nn.Sequential(*layers)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = self.embedder(x)
-        x = x.view(*x.shape[:-2], -1)
-
-        for layer in self.layers:
-            x = layer(x)
-        return x
+        return self.layers(self.embedder(x).flatten(-2))
 
 
 class TheLightningModel(L.LightningModule):
-    def __init__(self, model: Model, defaults: FITDatasetDefaults, lr: float) -> None:
+    def __init__(
+        self,
+        model: Model,
+        defaults: FITDatasetDefaults,
+        lr: float,
+        compile_model: bool = False,
+    ) -> None:
         super().__init__()
-        self.model = model
+        self.model = (
+            torch.compile(model, mode="reduce-overhead", fullgraph=False)
+            if compile_model
+            else model
+        )
         self.lr = lr
         self.defaults = defaults
-        self.loss_module = torch.nn.CrossEntropyLoss()
+        self._target_table = defaults.target_table
+        self._target: Optional[
+            Tuple[torch.Tensor, torch.Tensor, Dict[str, torch.Tensor]]
+        ] = None
+
+    def on_fit_start(self) -> None:
+        # the dataloaders aren't available yet - the cache is filled by the first batch
+        self._target = None
+
+    def _get_target(
+        self, data: HeteroData
+    ) -> Tuple[torch.Tensor, torch.Tensor, Dict[str, torch.Tensor]]:
+        # the whole dataset is a single fixed graph, so its target tensors can be cached
+        if self._target is None:
+            target_tbl = data[self._target_table]
+            idx = {mode: target_tbl[f"{mode}_idx"] for mode in ["train", "val", "test"]}
+            self._target = (target_tbl.x, target_tbl.y, idx)
+        return self._target
 
     def forward(self, data: HeteroData, mode: Literal["train", "test", "val"]):
-        target_tbl = data[self.defaults.target_table]
-
-        out = self.model(target_tbl.x)
+        x, y, idx_dict = self._get_target(data)
 
-        if mode == "train":
-            mask = target_tbl.train_mask
-        elif mode == "val":
-            mask = target_tbl.val_mask
-        elif mode == "test":
-            mask = target_tbl.test_mask
-        else:
+        if mode not in idx_dict:
             raise ValueError()
+        idx = idx_dict[mode]
+
+        out = self.model(x)
 
-        loss = self.loss_module(out[mask], target_tbl.y[mask])
-        acc = (out[mask].argmax(dim=-1) == target_tbl.y[mask]).sum().float() / mask.sum()
+        logits_sel = out.index_select(0, idx)
+        y_sel = y.index_select(0, idx)
+
+        loss = F.cross_entropy(logits_sel, y_sel, reduction="mean")
+        acc = (logits_sel.argmax(dim=-1) == y_sel).float().mean()
         return loss, acc
 
     def configure_optimizers(self):
         return torch.optim.Adam(self.parameters(), lr=self.lr)
 
+    def transfer_batch_to_device(self, batch, device, dataloader_idx):
+        # the data is placed on the device once in main(), not on every step
+        return batch
+
     def training_step(self, batch, batch_idx):
         loss, acc = self.forward(batch, mode="train")
 
-        self.log("train_loss", loss, batch_size=1, prog_bar=True)
-        self.log("train_acc", acc, batch_size=1, prog_bar=True)
+        self.log("train_loss", loss, on_step=False, on_epoch=True, batch_size=1)
+        self.log("train_acc", acc, on_step=False, on_epoch=True, batch_size=1)
 
         return loss
 
     def validation_step(self, batch, batch_idx):
         _, acc = self.forward(batch, mode="val")
 
-        self.log("val_acc", acc, batch_size=1, prog_bar=True)
+        self.log("val_acc", acc, on_step=False, on_epoch=True, batch_size=1, prog_bar=True)
 
     def test_step(self, batch, batch_idx):
         _, acc = self.forward(batch, mode="test")
 
-        self.log("test_acc", acc, batch_size=1, prog_bar=True)
+        self.log("test_acc", acc, on_step=False, on_epoch=True, batch_size=1)
 
 
 _T = TypeVar("_T")
@@ -233,11 +331,25 @@ def create_data(
             dataset=dataset,
             conn=conn,
             schema=schema,
-            # device=device
+            device=device,
         )
 
-        n_total = data[defaults.target_table].x.shape[0]
-        T.RandomNodeSplit("train_rest", num_val=int(0.30 * n_total), num_test=0)(data)
+        # random 70/30 train/val split (no test set)
+        target_tbl = data[defaults.target_table]
+        n_total = target_tbl.x.shape[0]
+        mask_device = target_tbl.x.device
+        perm = torch.from_numpy(np.random.permutation(n_total)).to(mask_device)
+        n_val = int(0.30 * n_total)
+
+        target_tbl.train_mask = torch.zeros(n_total, dtype=torch.bool, device=mask_device)
+        target_tbl.train_mask[perm[n_val:]] = True
+        target_tbl.val_mask = torch.zeros(n_total, dtype=torch.bool, device=mask_device)
+        target_tbl.val_mask[perm[:n_val]] = True
+        target_tbl.test_mask = torch.zeros(n_total, dtype=torch.bool, device=mask_device)
+
+        # index tensors for index_select, so that the masks aren't scanned on every step
+        for mode in ["train", "val", "test"]:
+            target_tbl[f"{mode}_idx"] = target_tbl[f"{mode}_mask"].nonzero(as_tuple=True)[0]
 
         return data, data_pd, schema, defaults, column_defs, colnames
 
@@ -250,24 +362,46 @@ def create_model(
     dataset_name=DEFAULT_DATASET_NAME,
     model_config: Optional[ModelConfig] = None,
     device=None,
+    jit: bool = False,
 ):
     if model_config is None:
         model_config = ModelConfig()
 
     defaults = FIT_DATASET_DEFAULTS[dataset_name]
 
+    check_categorical_codes(
+        data[defaults.target_table].x,
+        column_defs[defaults.target_table],
+        colnames[defaults.target_table],
+    )
+
     model = Model(
         schema=schema,
         config=model_config,
         n_features=len(column_defs[defaults.target_table]),
         defaults=defaults,
         column_defs=column_defs[defaults.target_table],
-        column_names=colnames[defaults.target_table],
     )
 
+    if jit:
+        model = torch.jit.script(model)
+
     return model
 
 
+class SingletonLoader:
+    """Yields a single, already prepared batch - with none of the `DataLoader` overhead."""
+
+    def __init__(self, batch: HeteroData) -> None:
+        self.batch = batch
+
+    def __iter__(self):
+        yield self.batch
+
+    def __len__(self) -> int:
+        return 1
+
+
 class TimerOrEpochsCallback(L_callbacks.Callback):
     def __init__(
         self, epochs: int, min_train_time_s: float, epochs_multiplier: int = 10
@@ -313,28 +447,34 @@ class BestMetricsLoggerCallback(L_callbacks.Callback):
 
         self.monitor = monitor
         self.cmp: Literal["min", "max"] = cmp
+        self.is_better: Callable[[float, float], bool] = (
+            operator.lt if cmp == "min" else operator.gt
+        )
         self.metrics = metrics
         self.last_value: Optional[float] = None
 
     def on_train_epoch_end(
         self, trainer: "L.Trainer", pl_module: "L.LightningModule"
     ) -> None:
-        if self.monitor in trainer.callback_metrics:
-            mon_value = trainer.callback_metrics[self.monitor].detach().cpu().item()
-
-            if (
-                self.last_value is None
-                or (self.cmp == "min" and mon_value < self.last_value)
-                or (self.cmp == "max" and mon_value > self.last_value)
-            ):
-                self.last_value = mon_value
-                for metric_name, log_as in self.metrics.items():
-                    if metric_name in trainer.callback_metrics:
-                        this_value = (
-                            trainer.callback_metrics[metric_name].detach().cpu().item()
-                        )
-                        if metric_name in trainer.callback_metrics:
-                            pl_module.log(log_as, this_value, prog_bar=True)
+        if self.monitor not in trainer.callback_metrics:
+            return
+
+        names = [
+            self.monitor,
+            *(m for m in self.metrics if m in trainer.callback_metrics),
+        ]
+
+        # a single device -> host transfer for all the metrics
+        mon_value, *values = (
+            torch.stack([trainer.callback_metrics[m].detach().float() for m in names])
+            .cpu()
+            .tolist()
+        )
+
+        if self.last_value is None or self.is_better(mon_value, self.last_value):
+            self.last_value = mon_value
+            for metric_name, value in zip(names[1:], values):
+                pl_module.log(self.metrics[metric_name], value, prog_bar=True)
 
 
 def main(
@@ -345,6 +485,10 @@ def main(
     learning_rate: float = 3e-4,
     min_train_time_s: float = 60.0,
     cuda: bool = False,
+    compile_model: bool = False,
+    jit: bool = False,
+    deterministic: bool = False,
+    mlflow_enabled: bool = False,
 ):
     if data_config is None:
         data_config = DataConfig()
@@ -352,31 +496,88 @@ def main(
     if model_config is None:
         model_config = ModelConfig()
 
+    if not cuda:
+        # the GEMMs of a small MLP are too small to benefit from many threads
+        torch.set_num_threads(min(8, os.cpu_count() or 1))
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError as e:
+            # can only be set once, before any inter-op parallel work has started
+            warnings.warn(
+                f"Keeping {torch.get_num_interop_threads()} inter-op threads. Reason: {e}"
+            )
+
     device = "cuda" if cuda else "cpu"
     data, data_pd, schema, defaults, column_defs, colnames = create_data(
         dataset_name, data_config, device
     )
+    if cuda:
+        # the whole dataset is a single graph - move it to the GPU just once
+        data = data.to(device)
+
     print(schema)
     print(data)
 
     model = create_model(
-        data, schema, column_defs, colnames, dataset_name, model_config, device
+        data,
+        schema,
+        column_defs,
+        colnames,
+        dataset_name,
+        model_config,
+        device,
+        # scripting and torch.compile don't mix - torch.compile takes precedence
+        jit=jit and not compile_model,
     )
     print(model)
 
-    lightning_model = TheLightningModel(model, defaults=defaults, lr=learning_rate)
+    lightning_model = TheLightningModel(
+        model, defaults=defaults, lr=learning_rate, compile_model=compile_model
+    )
+
+    if compile_model:
+        # compiled artifacts are reused across runs (override with TORCHINDUCTOR_CACHE_DIR)
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", "./torch-compile-cache/")
+
+    precision = "bf16-mixed" if cuda and torch.cuda.is_bf16_supported() else "32-true"
+
+    if compile_model or jit:
+        # warm up, so that compilation is not counted into the training time
+        # (a scripted model profiles and fuses its graph during the first two runs)
+        lightning_model.to(device)
+        x = data[defaults.target_table].x.to(device)
+
+        # the warm-up must not touch BatchNorm running stats or the dropout RNG
+        buffers = {name: b.clone() for name, b in lightning_model.named_buffers()}
+        rng_devices = [torch.cuda.current_device()] if cuda else []
+
+        # same autocast as the Trainer, otherwise the compiled graph is not reused
+        with torch.random.fork_rng(devices=rng_devices), torch.autocast(
+            device_type=device, dtype=torch.bfloat16, enabled=precision == "bf16-mixed"
+        ):
+            for _ in range(2):
+                lightning_model.model(x)
+
+        with torch.no_grad():
+            for name, b in lightning_model.named_buffers():
+                b.copy_(buffers[name])
 
     trainer = L.Trainer(
         accelerator="gpu" if cuda else "cpu",
         devices=1,
-        deterministic=True,
+        deterministic=deterministic,
+        benchmark=not deterministic,
+        precision=precision,
         callbacks=[
             L_callbacks.Timer(),
             L_callbacks.ModelCheckpoint(
                 "./torch-models/",
-                filename=dataset_name + "-{epoch}-{train_acc:.3f}-{val_acc:.3f}",
+                filename=dataset_name + "-{epoch}-{val_acc:.3f}",
                 mode="max",
                 monitor="val_acc",
+                save_top_k=1,
+                # only the best weights are needed, not a resumable training state
+                save_weights_only=True,
             ),
             BestMetricsLoggerCallback(monitor="val_acc", cmp="max"),
             TimerOrEpochsCallback(epochs=epochs, min_train_time_s=min_train_time_s),
@@ -384,9 +585,14 @@ def main(
         min_epochs=epochs,
         max_epochs=-1,
         max_steps=-1,
+        num_sanity_val_steps=0,
+        enable_progress_bar=False,
+        log_every_n_steps=epochs,
+        check_val_every_n_epoch=max(1, epochs // 20),
+        logger=mlflow_enabled,
     )
 
-    dataloader = DataLoader([data], batch_size=1)
+    dataloader = SingletonLoader(data)
 
     trainer.fit(lightning_model, dataloader, dataloader)
 
@@ -399,6 +605,11 @@ if __name__ == "__main__":
     parser.add_argument("--learning-rate", "--lr", "-r", type=float, default=0.0001)
     parser.add_argument("--min-train-time", "-t", type=float, default=60.0)
     parser.add_argument("--mlflow", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--compile", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--jit", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument(
+        "--deterministic", action=argparse.BooleanOptionalAction, default=False
+    )
     parser.add_arguments(ModelConfig, dest="model_config")
     parser.add_arguments(DataConfig, dest="data_config")
     args = parser.parse_args()
@@ -410,6 +621,9 @@ if __name__ == "__main__":
     do_mlflow: bool = args.mlflow
     learning_rate: float = args.learning_rate
     min_train_time_s: float = args.min_train_time
+    compile_model: bool = args.compile
+    jit: bool = args.jit
+    deterministic: bool = args.deterministic
 
     def _run_main():
         main(
@@ -420,6 +634,10 @@ if __name__ == "__main__":
             learning_rate,
             min_train_time_s,
             cuda,
+            compile_model,
+            jit,
+            deterministic,
+            do_mlflow,
         )
 
     if do_mlflow: